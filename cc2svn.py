@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 #===============================================================================
 # The MIT License
@@ -77,21 +77,21 @@ LICENSING
     cc2svn.py is distributed under the MIT license.
 """
 
-from __future__ import with_statement
-import os, subprocess, time, sys, hashlib, codecs, fnmatch, shutil, stat
+import os, subprocess, time, sys, hashlib, codecs, fnmatch, shutil, stat, re, uuid, mmap, pickle, itertools, functools, queue, threading
+from multiprocessing.pool import ThreadPool
 
 USAGE = "Usage: %(cmd)s -run [config.ini] | -help" % { "cmd" : sys.argv[0] }
 
 if len(sys.argv) <= 1:
-    print USAGE
+    print(USAGE)
     sys.exit(1)
 
 if sys.argv[1] == "-help":
-    print __doc__
+    print(__doc__)
     sys.exit(0)
 
 if sys.argv[1] != "-run":
-    print USAGE
+    print(USAGE)
     sys.exit(1)
 
 ############# constants ######################
@@ -100,10 +100,25 @@ HISTORY_FIELD_SEPARATOR = "@@@"
 
 HISTORY_FORMAT = "%Nd;%En;%Vn;%o;%l;%a;%m;%u;%Nc;\\n".replace(";", HISTORY_FIELD_SEPARATOR)
 
+# one record of HISTORY_FORMAT output: 8 single line fields and the comment which may have several lines
+HISTORY_RECORD = re.compile("^" + ("([^\\n]*?)" + re.escape(HISTORY_FIELD_SEPARATOR)) * 8 +
+                            "(.*?)" + re.escape(HISTORY_FIELD_SEPARATOR) + "(?:\\n|\\Z)", re.DOTALL | re.MULTILINE)
+
+# 'descr' of several versions: each HISTORY_FORMAT record is followed by the separator line
+DESCR_RECORD_SEPARATOR = "@@@EOR@@@"
+DESCR_FORMAT = HISTORY_FORMAT + DESCR_RECORD_SEPARATOR + "\\n"
+# max number of versions and of their name characters in one 'descr' command
+DESCR_BATCHSIZE = 200
+DESCR_BATCHCHARS = 32 * 1024
+
 CC_DATE_FORMAT = "%Y%m%d.%H%M%S"
-SVN_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.000000Z"
+SVN_DATE_FORMAT = "%s-%s-%sT%s:%s:%s.000000Z" # year, month, day, hour, minute, second
 
-FILEREAD_CHUNKSIZE = 512
+FILEREAD_CHUNKSIZE = 256 * 1024
+FILEREAD_MAXINMEMORY = 4 * 1024 * 1024 # bigger files are read twice: for the checksum and for the dump
+DUMPFILE_BUFSIZE = 4 * 1024 * 1024
+# max number of bytes waiting for the dump writer thread, a single bigger chunk is still accepted
+DUMPWRITE_MAXPENDING = 16 * 1024 * 1024
 
 ############# parameters ######################
 mydir = os.path.dirname(os.path.realpath(__file__))
@@ -112,60 +127,96 @@ if len(sys.argv) > 2:
 else:
     confname = mydir + '/config.ini'
 
-import ConfigParser
-conf = ConfigParser.ConfigParser({'dir' : mydir})
+import configparser
+conf = configparser.ConfigParser({'dir' : mydir})
 conf.read(confname)
 
 def getparam(fn, section, opt):
     try:
         return fn(section, opt)
-    except ConfigParser.NoOptionError:
+    except configparser.NoOptionError:
         return None
 
-CC_LABELS_FILE = getparam(conf.get, 'global', 'cc_labels_file')
-CC_BRANCHES_FILE = getparam(conf.get, 'global', 'cc_branches_file')
-CC_CONFIG_SPEC_DIR = getparam(conf.get, 'global', 'cc_config_spec_dir')
+def inputPath(path):
+    # symbolic links are resolved for the existing files and directories used by the tool
+    return path and os.path.realpath(path)
+
+def outputPath(path):
+    # the files created by the tool, os.path.abspath does not need to access the file system
+    return path and os.path.abspath(path)
+
+CC_LABELS_FILE = inputPath(getparam(conf.get, 'global', 'cc_labels_file'))
+CC_BRANCHES_FILE = inputPath(getparam(conf.get, 'global', 'cc_branches_file'))
+CC_CONFIG_SPEC_DIR = inputPath(getparam(conf.get, 'global', 'cc_config_spec_dir'))
 DUMP_SINCE_DATE = getparam(conf.get, 'global', 'dump_since_date')
-CLEARTOOL = os.path.realpath(getparam(conf.get, 'global', 'cleartool'))
-CC_VOB_DIR = os.path.realpath(getparam(conf.get, 'global', 'cc_vob_dir'))
-CACHE_DIR = os.path.realpath(getparam(conf.get, 'global', 'cache_dir'))
-SVN_AUTOPROPS_FILE = os.path.realpath(getparam(conf.get, 'global', 'svn_autoprops_file'))
-SVN_DUMP_FILE = os.path.realpath(getparam(conf.get, 'global', 'svn_dump_file'))
-HISTORY_FILE = os.path.realpath(getparam(conf.get, 'global', 'history_file'))
-CC_IGNORED_DIRECTORIES_FILE = getparam(conf.get, 'global', 'cc_ignored_directories_file')
+CLEARTOOL = inputPath(getparam(conf.get, 'global', 'cleartool'))
+CC_VOB_DIR = inputPath(getparam(conf.get, 'global', 'cc_vob_dir'))
+CACHE_DIR = inputPath(getparam(conf.get, 'global', 'cache_dir'))
+SVN_AUTOPROPS_FILE = inputPath(getparam(conf.get, 'global', 'svn_autoprops_file'))
+SVN_DUMP_FILE = outputPath(getparam(conf.get, 'global', 'svn_dump_file'))
+HISTORY_FILE = outputPath(getparam(conf.get, 'global', 'history_file'))
+CC_IGNORED_DIRECTORIES_FILE = inputPath(getparam(conf.get, 'global', 'cc_ignored_directories_file'))
 SVN_CREATE_BRANCHES_TAGS_DIRS = getparam(conf.get, 'global', 'svn_create_branches_tags_dirs')
 ENCODING = getparam(conf.get, 'global', 'encoding')
 CHECK_ZEROSIZE_CACHEFILE = getparam(conf.get, 'global', 'check_zerosize_cachefile')
 IGNORE_CHILD_BRANCH_WARNING = getparam(conf.get, 'global', 'ignore_child_branch_warning')
-SVN_TMP_DUMP_FILE = os.path.realpath(getparam(conf.get, 'global', 'svn_tmp_dump_file'))
-BRANCH_HISTORY_FILE = os.path.realpath(getparam(conf.get, 'global', 'cc_branch_history_file'))
-RUN_STATE_FILE = os.path.realpath(getparam(conf.get, 'global', 'run_state_file'))
+BRANCH_HISTORY_FILE = outputPath(getparam(conf.get, 'global', 'cc_branch_history_file'))
+RUN_STATE_FILE = outputPath(getparam(conf.get, 'global', 'run_state_file'))
+FETCH_PARALLELISM = getparam(conf.get, 'global', 'fetch_parallelism')
+ON_ERROR_POLICY = getparam(conf.get, 'global', 'on_error_policy')
 
-if CC_LABELS_FILE:
-    CC_LABELS_FILE = os.path.realpath(CC_LABELS_FILE)
-
-if CC_BRANCHES_FILE:
-    CC_BRANCHES_FILE = os.path.realpath(CC_BRANCHES_FILE)
-
-if CC_CONFIG_SPEC_DIR:
-    CC_CONFIG_SPEC_DIR = os.path.realpath(CC_CONFIG_SPEC_DIR)
+# the history dates are kept as the CC_DATE_FORMAT text printed by cleartool (%Nd)
+# its fixed width fields go from the year to the second, so the strings compare like the dates
+def parseCCDate(s):
+    # checks the date and returns it in the exact form used by cleartool
+    return time.strftime(CC_DATE_FORMAT, time.strptime(s.strip(), CC_DATE_FORMAT))
 
 if DUMP_SINCE_DATE:
-    DUMP_SINCE_DATE = time.strptime(DUMP_SINCE_DATE, CC_DATE_FORMAT)
-
-if CC_IGNORED_DIRECTORIES_FILE:
-    CC_IGNORED_DIRECTORIES_FILE = os.path.realpath(CC_IGNORED_DIRECTORIES_FILE)
+    DUMP_SINCE_DATE = parseCCDate(DUMP_SINCE_DATE)
 
 if not IGNORE_CHILD_BRANCH_WARNING:
     IGNORE_CHILD_BRANCH_WARNING = 'false'
 
+if ENCODING:
+    ENCODING = ENCODING.strip('"')
+else:
+    ENCODING = 'utf8'
+
+if FETCH_PARALLELISM:
+    FETCH_PARALLELISM = int(FETCH_PARALLELISM)
+else:
+    FETCH_PARALLELISM = 8
+
+# "[retry:N,]prompt|ignore|exit": failed commands are retried N times, then the user is asked
+# (on a terminal only) or the command is ignored or the tool exits
+if ON_ERROR_POLICY:
+    ON_ERROR_POLICY = ON_ERROR_POLICY.strip('"')
+elif sys.stdin.isatty():
+    ON_ERROR_POLICY = 'prompt'
+else:
+    ON_ERROR_POLICY = 'retry:3,ignore'
+
+ERROR_RETRIES = 0
+ERROR_ACTION = 'prompt'
+for item in ON_ERROR_POLICY.replace(" ", "").split(","):
+    if item.startswith("retry:"):
+        ERROR_RETRIES = int(item[len("retry:"):])
+    elif item in ('prompt', 'ignore', 'exit'):
+        ERROR_ACTION = item
+    else:
+        raise ValueError("Wrong on_error_policy: " + ON_ERROR_POLICY)
+
 CCVIEW_TMPFILE = CACHE_DIR + os.sep + "label_config_spec_tmp_cc2svnpy"
 CCVIEW_CONFIGSPEC = CACHE_DIR + os.sep + "user_config_spec_tmp_cc2svnpy"
 
 ############# utilities ######################
 
+# the names from ClearCase may hold undecodable bytes, they are printed as they are
+if hasattr(sys.stdout, 'reconfigure'):
+    sys.stdout.reconfigure(errors='surrogateescape')
+
 def logMessage(text):
-    print time.strftime("%Y/%m/%d %H:%M:%S:"), text
+    print(time.strftime("%Y/%m/%d %H:%M:%S:"), text)
 
 def info(text):
     logMessage("INFO: " + text)
@@ -179,7 +230,7 @@ def error(text):
 
 def runCmd(cmd, cwd=None, outfile=None):
     outfd = subprocess.PIPE
-    outStr = ""
+    outStr = b""
     status = 0
     while True:
         try:
@@ -200,8 +251,9 @@ def runCmd(cmd, cwd=None, outfile=None):
 
 def shellCmd(cmd, cwd=None, outfile=None):
     outfd = subprocess.PIPE
-    outStr = ""
+    outStr = b""
     status = ""
+    attempt = 0
     while True:
         try:
             if outfile:
@@ -213,23 +265,38 @@ def shellCmd(cmd, cwd=None, outfile=None):
             if outfile:
                 outfd.close()
             if p.returncode != 0:
-                raise RuntimeError("Exit code: " + str(p.returncode) + "\n" + errStr)
+                raise RuntimeError("Exit code: " + str(p.returncode) + "\n" + errStr.decode(ENCODING, 'replace'))
             if len(errStr) > 0:
-                raise RuntimeError("Command has non-empty error stream: \n" + errStr)
+                raise RuntimeError("Command has non-empty error stream: \n" + errStr.decode(ENCODING, 'replace'))
         except:
             error("Command failed: " + str(cmd) + "\n" + str(sys.exc_info()[1]))
-            status = askRetryContinueExit()
+            attempt += 1
+            status = askRetryContinueExit(attempt)
             if status == "retry": continue
         break
     return (status, outStr)
 
+def canPrompt():
+    return ERROR_ACTION == 'prompt' and sys.stdin.isatty()
+
 gIgnoreAll = False
-def askRetryContinueExit():
+def askRetryContinueExit(attempt=1):
+    # attempt is the number of failures of the same command
     global gIgnoreAll
     if gIgnoreAll:
         return "ignore"
+    if attempt <= ERROR_RETRIES:
+        info("Retry " + str(attempt) + " of " + str(ERROR_RETRIES))
+        return "retry"
+    if not canPrompt():
+        if ERROR_ACTION == 'ignore':
+            warn("Error ignored by on_error_policy")
+            return "ignore"
+        error("Exit by on_error_policy " + ON_ERROR_POLICY)
+        sys.exit(1)
     while True:
-        print "\nRetry/Ignore/IgnoreAll/Exit? [r/i/a/x] (r:Enter): ",
+        print("\nRetry/Ignore/IgnoreAll/Exit? [r/i/a/x] (r:Enter): ", end="")
+        sys.stdout.flush()
         answer = sys.stdin.readline().strip()
         if answer == "" or answer == "r": return "retry"
         if answer == "i": return "ignore"
@@ -238,98 +305,203 @@ def askRetryContinueExit():
             return "ignore"
         if answer == "x": sys.exit(1)
 
-def askYesNo(question):
+def askYesNo(question, isError=False):
+    # isError: the question decides on an error, "no" means exit like the exit action of on_error_policy
+    if not canPrompt():
+        if not isError or ERROR_ACTION == 'ignore':
+            # the default answer, the same as Enter
+            info(question + " y")
+            return True
+        error(question + " Exit by on_error_policy " + ON_ERROR_POLICY)
+        sys.exit(1)
     while True:
-        print "\n"+question+" [y/n] (y:Enter): ",
+        print("\n"+question+" [y/n] (y:Enter): ", end="")
+        sys.stdout.flush()
         answer = sys.stdin.readline().strip()
         if answer == "" or answer == "y": return True
         if answer == "n": return False
 
-def toUTF8(text):
-    unicode_str = text.decode(ENCODING)
-    return unicode_str.encode("utf8")
+class CleartoolSession:
+    """Long-living interactive cleartool process.
 
-    #return codecs.utf_8_encode(text)[0]
+    Saves the cleartool start-up (and license check) for commands issued once per file version.
+    Each command is followed by a shell command echoing a sentinel to the error stream and to the output
+    so the end of both can be found, the exit code is taken from the 'Command N returned status S' line
+    printed in -status mode. The output and the error stream are returned separately as bytes.
+    """
+    def __init__(self, cwd=None):
+        self.cwd = cwd
+        self.process = None
+        self.sentinel = "__DONE_" + uuid.uuid4().hex + "__"
+
+    def start(self):
+        self.process = subprocess.Popen([CLEARTOOL, '-status'], cwd=self.cwd, stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=-1)
+        self.commandNum = 0
+        # the error stream is read by a thread: a command writing a lot of errors can not block its output
+        self.errLines = queue.Queue()
+        reader = threading.Thread(target=self.readErrors, args=(self.process.stderr, self.errLines),
+                                  name="cleartool errors")
+        reader.daemon = True
+        reader.start()
+
+    def readErrors(self, stream, errLines):
+        for line in iter(stream.readline, b""):
+            errLines.put(line)
+        errLines.put(None) # end of the stream
+
+    def close(self):
+        if self.process is not None:
+            try:
+                self.process.stdin.write(b"quit\n")
+                self.process.stdin.close()
+                self.process.wait()
+            except:
+                self.kill()
+            self.process = None
+
+    def kill(self):
+        if self.process is not None:
+            try: self.process.kill()
+            except: pass
+            self.process = None
+
+    def quote(self, arg):
+        if arg and not re.search(r'[\s"\'\\]', arg):
+            return arg
+        return '"' + arg.replace('"', '\\"') + '"'
+
+    def run(self, args):
+        if self.process is None or self.process.poll() is not None:
+            self.start()
+        try:
+            # '1>&2' and '&&' mean the same for sh and cmd.exe
+            cmdline = (" ".join([self.quote(arg) for arg in args]) + "\n" +
+                       "shell echo " + self.sentinel + " 1>&2 && echo " + self.sentinel + "\n")
+            self.process.stdin.write(toCC(cmdline))
+            self.process.stdin.flush()
+            self.commandNum += 2
+            sentinel = self.sentinel.encode('ascii')
+            statusLine = re.compile(br"^Command (\d+) returned status (\d+)\s*$")
+            lines = []
+            status = 0
+            while True:
+                line = self.process.stdout.readline()
+                if not line:
+                    raise RuntimeError("cleartool process terminated unexpectedly")
+                if line.strip() == sentinel:
+                    break
+                m = statusLine.match(line)
+                if m and int(m.group(1)) == self.commandNum - 1:
+                    status = int(m.group(2))
+                elif m and int(m.group(1)) == self.commandNum - 2:
+                    pass # status of the previous sentinel
+                else:
+                    lines.append(line)
+            errLines = []
+            while True:
+                line = self.errLines.get()
+                if line is None:
+                    raise RuntimeError("cleartool process terminated unexpectedly")
+                if line.strip() == sentinel:
+                    break
+                errLines.append(line)
+        except:
+            self.kill()
+            raise
+        return (status, b"".join(lines), b"".join(errLines))
+
+def sessionCmd(session, cmd):
+    # the same as shellCmd for the commands sent to a CleartoolSession (without the leading CLEARTOOL)
+    outStr = b""
+    status = ""
+    attempt = 0
+    while True:
+        try:
+            (returncode, outStr, errStr) = session.run(cmd)
+            if returncode != 0:
+                raise RuntimeError("Exit code: " + str(returncode) + "\n" + errStr.decode(ENCODING, 'replace'))
+            if len(errStr) > 0:
+                raise RuntimeError("Command has non-empty error stream: \n" + errStr.decode(ENCODING, 'replace'))
+        except:
+            error("Command failed: " + str(cmd) + "\n" + str(sys.exc_info()[1]))
+            attempt += 1
+            status = askRetryContinueExit(attempt)
+            if status == "retry": continue
+        break
+    return (status, outStr)
 
-def rblocks(f, blocksize=4096):
-    """Read file as series of blocks from end of file to start.
+# the same paths come again for each version, the pure path functions are memoized
+cachedNormpath = functools.lru_cache(maxsize=100000)(os.path.normpath)
+cachedDirname = functools.lru_cache(maxsize=100000)(os.path.dirname)
+cachedBasename = functools.lru_cache(maxsize=100000)(os.path.basename)
 
-    The data itself is in normal order, only the order of the blocks is reversed.
-    ie. "hello world" -> ["ld","wor", "lo ", "hel"]
-    Note that the file must be opened in binary mode.
-    """
-    if 'b' not in f.mode.lower():
-        raise Exception("File must be opened using binary mode.")
-    size = os.stat(f.name).st_size
-    fullblocks, lastblock = divmod(size, blocksize)
+# the element names printed by cleartool are the bytes of the file system, they are decoded like os.fsdecode()
+# so the same str goes back to the file system and to cleartool and compares with the os.scandir() names
+# (on Windows the system calls take the text, the names are decoded with ENCODING)
+if os.name == 'nt':
+    NAME_ENCODING = ENCODING
+else:
+    NAME_ENCODING = sys.getfilesystemencoding()
 
-    # The first(end of file) block will be short, since this leaves
-    # the rest aligned on a blocksize boundary.  This may be more
-    # efficient than having the last (first in file) block be short
-    f.seek(-lastblock,2)
-    yield f.read(lastblock)
+ccDecode = codecs.getdecoder(NAME_ENCODING)
 
-    for i in xrange(fullblocks-1,-1, -1):
-        f.seek(i * blocksize)
-        yield f.read(blocksize)
+def fromCC(data):
+    # decodes cleartool output (bytes or a mapped file), the ASCII text (most of it) does not need the codec
+    try:
+        return str(data, "ascii")
+    except UnicodeDecodeError:
+        return ccDecode(data, 'surrogateescape')[0]
 
-def rlines(f, keepends=False):
-    """Iterate through the lines of a file in reverse order.
+def toCC(text):
+    # the bytes fromCC was given
+    return text.encode(NAME_ENCODING, 'surrogateescape')
 
-    If keepends is true, line endings are kept as part of the line.
-    """
-    buf = ''
-    for block in rblocks(f):
-        buf = block + buf
-        lines = buf.splitlines(keepends)
-        # Return all lines except the first (since may be partial)
-        if lines:
-            lines.reverse()
-            buf = lines.pop() # Last line becomes end of new first line.
-            for line in lines:
-                yield line
-    yield buf  # First line.
+def toUTF8(text):
+    # the ClearCase text is transcoded from ENCODING only for the dump
+    if text.isascii():
+        return text.encode("ascii")
+    return toCC(text).decode(ENCODING).encode("utf8")
 
 ############# heart of the script ######################
 
 class SvnProperties:
+    # the properties are kept serialized in the dump format, the same keys are set again for each revision
+    __slots__ = ('body', 'offsets', 'totalLen')
+
     def __init__(self):
-        self.keyset = {}
+        self.body = bytearray()
+        self.offsets = {} # key -> (offset, length) of its record in body
         self.totalLen = 10 # len('PROPS-END\n')
 
     def reset(self):
-        self.keyset.clear()
+        self.body.clear()
+        self.offsets.clear()
         self.totalLen = 10
 
     def set(self, key, value):
-        if self.keyset.has_key(key): # this will probably not happen
-            self.totalLen -= self.calcPropLength(key, self.keyset.get(key))
-        self.keyset[key] = value
-        self.totalLen += self.calcPropLength(key, value)
-
-    def calcPropLength(self, key, value):
-        klen = len("K " + str(len(key)) + "\n" + key + "\n")
-        vlen = len("V " + str(len(value)) + "\n" + value + "\n")
-        return klen + vlen
-
-    def writeLength(self, out):
-        out.write("Prop-content-length: " + str(self.totalLen) + "\n");
-
-    def writeContent(self, out):
-        for key,value in self.keyset.iteritems():
-            out.write("K " + str(len(key)) + "\n");
-            out.write(key + "\n");
-            out.write("V " + str(len(value)) + "\n");
-            if value: out.write(value)
-            out.write("\n")
-        out.write("PROPS-END\n");
+        record = b"K %d\n%s\nV %d\n%s\n" % (len(key), key, len(value), value)
+        if key in self.offsets:
+            # replace the record in place, the records after it are moved
+            (offset, length) = self.offsets[key]
+            self.body[offset:offset + length] = record
+            delta = len(record) - length
+            if delta:
+                for otherKey, (otherOffset, otherLength) in self.offsets.items():
+                    if otherOffset > offset:
+                        self.offsets[otherKey] = (otherOffset + delta, otherLength)
+        else:
+            offset = len(self.body)
+            self.body += record
+        self.offsets[key] = (offset, len(record))
+        self.totalLen = len(self.body) + 10
+
+    def content(self):
+        return self.body + b"PROPS-END\n"
 
     def dump(self, out):
-        self.writeLength(out);
-        out.write("Content-length: " + str(self.totalLen) + "\n");
-        out.write("\n");
-        self.writeContent(out);
-        out.write("\n\n");
+        out.write(b"Prop-content-length: %d\nContent-length: %d\n\n%sPROPS-END\n\n\n" %
+                  (self.totalLen, self.totalLen, self.body))
 
 EmptyProps = SvnProperties()
 
@@ -338,6 +510,12 @@ class SvnAutoProps:
         self.autoProps = {}
         self.load(filename)
 
+        # the result depends on the file name only, and with '*.ext' patterns only on the extension
+        self.matchers = [(re.compile(fnmatch.translate(os.path.normcase(pattern))), props)
+                         for pattern, props in self.autoProps.items()]
+        self.byExtension = all(re.match(r"^\*\.[^*?\[\].]+$", pattern) for pattern in self.autoProps)
+        self.cache = {}
+
     def load(self, filename):
         info("Loading svn auto properties from " + filename)
 
@@ -354,29 +532,36 @@ class SvnAutoProps:
                     value = fields[1]
                 else:
                     value = ""
-                props.set(key, value)
+                props.set(key.encode("utf8"), value.encode("utf8"))
         file.close()
 
     def getProps(self, filepath):
-        filename = os.path.basename(filepath)
-        for pattern, props in self.autoProps.iteritems():
-            if fnmatch.fnmatch(filename, pattern):
-                return props
-        return EmptyProps
+        filename = os.path.normcase(cachedBasename(filepath))
+        key = filename
+        if self.byExtension:
+            key = os.path.splitext(filename)[1] or filename
+        props = self.cache.get(key)
+        if props is None:
+            props = EmptyProps
+            for matcher, patternProps in self.matchers:
+                if matcher.match(filename):
+                    props = patternProps
+                    break
+            self.cache[key] = props
+        return props
 
 class CCRecord:
-    pass
+    # one instance per history record, __slots__ saves the per-instance dict
+    __slots__ = ('comment', 'date', 'path', 'revision', 'operation', 'labels', 'type', 'author',
+                 'branchNames', 'revNumber', 'svnbranch', 'svnpath')
 
 class CCHistoryParser:
-    def __init__(self):
-        self.prevline = ""
-
     def mkelemRecord (self, path, rev):
 
         ccRecord = CCRecord()
         ccRecord.comment = "";
-        ccRecord.date = time.strptime("20000101.000001", CC_DATE_FORMAT)
-        ccRecord.path = path;
+        ccRecord.date = "20000101.000001"
+        ccRecord.path = sys.intern(path);
         ccRecord.revision = rev;
         ccRecord.operation = "mkelem";
         ccRecord.labels = self.parseLabels("");
@@ -401,37 +586,56 @@ class CCHistoryParser:
         else:
             return []
 
-    def processLine(self, line):
-        if len(self.prevline) > 0:
-            line = line + "\n" + self.prevline
-
-        fields = line.split(HISTORY_FIELD_SEPARATOR)
+    def decode(self, data):
+        # data is the raw output of cleartool
+        text = fromCC(data)
+        if "\r\n" in text:
+            text = text.replace("\r\n", "\n")
+        return text
+
+    def parseHistory(self, data):
+        """Returns the records of the history in reverse order, i.e. from the oldest one to the newest one."""
+        text = self.decode(data)
+        records = []
+        end = 0
+        for match in HISTORY_RECORD.finditer(text):
+            if match.start() != end:
+                error("Wrong history line: " + text[end:match.start()])
+            records.append(self.makeRecord(match.groups()))
+            end = match.end()
+        if text[end:].strip():
+            error("Wrong history line: " + text[end:])
+        records.reverse()
+        return records
 
-        if len(fields) < 10:
-            self.prevline = line;
-            return None;
-        elif len(fields) > 10:
-            error("Wrong history line: " + line)
-            self.prevline = ""
+    def processLine(self, line):
+        # line is the cleartool output for a single record
+        text = self.decode(line)
+        if not text:
             return None
-        self.prevline = ""
+        match = HISTORY_RECORD.match(text)
+        if match is None or text[match.end():].strip():
+            error("Wrong history line: " + text)
+            return None
+        return self.makeRecord(match.groups())
 
+    def makeRecord(self, fields):
         # 20090729.162424;path/to/dir;/main/branch/another/1;checkin;(LABEL_1, LABEL2);;directory version;user1;Added file element file.cpp;
 
         ccRecord = CCRecord()
         ccRecord.comment = fields[8];
-        ccRecord.date = time.strptime(fields[0], CC_DATE_FORMAT)
-        ccRecord.path = os.path.normpath(fields[1]);
-        ccRecord.revision = fields[2];
+        ccRecord.date = fields[0]
+        # interned: the same paths and revisions come in many records and end up in ccTree and the FileSets
+        ccRecord.path = sys.intern(cachedNormpath(fields[1]));
+        ccRecord.revision = sys.intern(fields[2]);
         ccRecord.operation = fields[3];
-        ccRecord.labels = self.parseLabels(fields[4]);
+        ccRecord.labels = self.parseLabels(fields[4]) if fields[4] else [];
         ccRecord.type = fields[6];
         ccRecord.author = fields[7];
 
-        tags = self.parseLabels(fields[5])
-
-        for tag in tags:
-            ccRecord.comment += "\n" + tag
+        if fields[5]: # attributes, empty for most of the records
+            for tag in self.parseLabels(fields[5]):
+                ccRecord.comment += "\n" + tag
 
         revisionParts = ccRecord.revision.split(os.sep)
 
@@ -443,34 +647,35 @@ class CCHistoryParser:
             ccRecord.revNumber = "-1"
         return ccRecord
 
-def writeContentLength(out, len):
-    out.write("Content-length: " + str(len) + "\n");
-
-def writeTextContentLength(out, len):
-    out.write("Text-content-length: " + str(len) + "\n");
-
-def writeNodePath(out, nodePath):
-    out.write("Node-path: " + toUTF8(str.replace(nodePath, '\\', '/')) + "\n");
-
-def writeNodeKind(out, nodeKind):
-    out.write("Node-kind: " + nodeKind + "\n");
-
-def writeNodeAction(out, nodeAction):
-    out.write("Node-action: " + nodeAction + "\n");
+def svnNodePath(nodePath):
+    return toUTF8(nodePath.replace('\\', '/'))
 
 def calculateLengthAndChecksum(filename):
-    textContentLength = 0;
-    md = hashlib.md5()
+    # the whole file is hashed by a single C call: hashlib.file_digest (Python 3.11+) or md5 over the mapped file
+    with open(filename, 'rb') as file:
+        textContentLength = os.fstat(file.fileno()).st_size
+        if hasattr(hashlib, 'file_digest'):
+            checksum = hashlib.file_digest(file, 'md5').hexdigest()
+        elif textContentLength == 0: # empty files can not be mapped
+            checksum = hashlib.md5().hexdigest()
+        else:
+            content = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                checksum = hashlib.md5(content).hexdigest()
+            finally:
+                content.close()
+    return (textContentLength, checksum)
+
+def readContentAndChecksum(filename):
+    # small files are read once and the content is returned to be written to the dump,
+    # the content of bigger files is None and they must be streamed using writeContent
+    if os.path.getsize(filename) > FILEREAD_MAXINMEMORY:
+        textContentLength, checksum = calculateLengthAndChecksum(filename)
+        return (textContentLength, checksum, None)
     file = open(filename, 'rb')
-    while 1:
-        s = file.read(FILEREAD_CHUNKSIZE)
-        if s:
-            md.update(s)
-            textContentLength += len(s)
-        else: break
+    content = file.read()
     file.close()
-    checksum = md.hexdigest()
-    return (textContentLength, checksum)
+    return (len(content), hashlib.md5(content).hexdigest(), content)
 
 def writeContent(out, filename):
     file = open(filename, 'rb')
@@ -481,50 +686,92 @@ def writeContent(out, filename):
     file.close()
 
 def dumpSvnFile(out, action, path, props, contentFilename):
-    writeNodePath(out, path);
-    writeNodeKind(out, "file");
-    writeNodeAction(out, action);
-
-    props.writeLength(out);
-
-    textContentLength, checksum = calculateLengthAndChecksum(contentFilename);
-    writeTextContentLength(out, textContentLength);
-    out.write("Text-content-md5: " + checksum + "\n");
-    writeContentLength(out, textContentLength + props.totalLen );
-    out.write("\n");
+    textContentLength, checksum, content = readContentAndChecksum(contentFilename)
 
-    props.writeContent(out);
+    out.write(b"Node-path: %s\nNode-kind: file\nNode-action: %s\n"
+              b"Prop-content-length: %d\nText-content-length: %d\nText-content-md5: %s\nContent-length: %d\n\n%s" %
+              (svnNodePath(path), action.encode("ascii"), props.totalLen, textContentLength, checksum.encode("ascii"),
+               textContentLength + props.totalLen, props.content()))
 
-    writeContent(out, contentFilename);
-    out.write("\n\n");
+    if content is None:
+        writeContent(out, contentFilename)
+    else:
+        out.write(content)
+    out.write(b"\n\n");
 
 def dumpSvnCopy(out, kind, copyfromPath, copyfromRev, target):
-    writeNodePath(out, target);
-    writeNodeKind(out, kind);
-    writeNodeAction(out, "add");
-    out.write("Node-copyfrom-rev: " + str(copyfromRev) + "\n");
-    out.write("Node-copyfrom-path: " + toUTF8(str.replace(copyfromPath, '\\', '/')) + "\n");
-    out.write("\n");
+    out.write(b"Node-path: %s\nNode-kind: %s\nNode-action: add\nNode-copyfrom-rev: %d\nNode-copyfrom-path: %s\n\n" %
+              (svnNodePath(target), kind.encode("ascii"), copyfromRev, svnNodePath(copyfromPath)))
 
 def dumpSvnDir(out, path):
-    writeNodePath(out, path);
-    writeNodeKind(out, "dir");
-    writeNodeAction(out, "add");
-    out.write("\n");
+    out.write(b"Node-path: %s\nNode-kind: dir\nNode-action: add\n\n" % svnNodePath(path))
 
 def dumpSvnDelete(out, path):
-    writeNodePath(out, path);
-    writeNodeAction(out, "delete");
-    out.write("\n");
+    out.write(b"Node-path: %s\nNode-action: delete\n\n" % svnNodePath(path))
 
 
+def makeDirs(path):
+    # an existing directory is not an error, it is the usual case for the cache directories
+    os.makedirs(path, mode=0o777, exist_ok=True)
+
+def isCached(localfile):
+    # one stat call decides whether the cache file is valid, the same for the prefetch and the dump
+    # a zero size entry is left by an unsuccessful retrieving attempt, it is removed (see check_zerosize_cachefile)
+    try:
+        st = os.stat(localfile)
+    except OSError:
+        return False
+    if not CHECK_ZEROSIZE_CACHEFILE or st.st_size > 0:
+        return True
+    if stat.S_ISREG(st.st_mode):
+        os.chmod (localfile, stat.S_IWRITE)
+        os.remove (localfile)
+    elif stat.S_ISDIR(st.st_mode):
+        os.rmdir (localfile)
+    return False
+
+def cacheSymlink(symlinkfile, localfile):
+    # the content of an svn:special file: "link <target>"
+    try:
+        content = os.fsencode(os.readlink(symlinkfile))
+    except OSError:
+        raise RuntimeError("File " + symlinkfile + " is not a symbolic link")
+    with open(localfile, 'wb') as outfile:
+        outfile.writelines((b"link ", content))
+
+def cachePathFor(path, revision, cachedir=CACHE_DIR):
+    localfile = os.path.normpath(cachedir + "/" + path)
+    if revision:
+        localfile = os.path.normpath(localfile + "/" + revision)
+    return localfile
+
+def fetchFile(job):
+    # runs in the prefetch pool: no user interaction here, getFile will retry failed files later
+    (localfile, ccfile) = job
+    (status, out) = runCmd([CLEARTOOL, 'get', '-to', localfile, ccfile], cwd=CC_VOB_DIR)
+    if status != 0 and os.path.exists(localfile):
+        os.chmod (localfile, stat.S_IWRITE)
+        os.remove (localfile)
+    return status
+
+svnBranchPaths = {} # branch -> svn path, there are only a few branches and labels
+svnTagPaths = {}
+
 def getSvnBranchPath(branch):
-    return "branches/" + branch
+    path = svnBranchPaths.get(branch)
+    if path is None:
+        path = svnBranchPaths[branch] = "branches/" + branch
+    return path
 
 def getSvnTagPath(tag):
-    return "tags/" + tag
+    path = svnTagPaths.get(tag)
+    if path is None:
+        path = svnTagPaths[tag] = "tags/" + tag
+    return path
 
 class SvnRevisionProps:
+    __slots__ = ('properties',)
+
     def __init__(self):
         self.properties = SvnProperties()
 
@@ -536,35 +783,94 @@ class SvnRevisionProps:
 
     def setAuthor(self, author):
         try:
-            self.properties.set("svn:author", toUTF8(author));
+            self.properties.set(b"svn:author", toUTF8(author));
         except:
-            self.properties.set("svn:author", "");
+            self.properties.set(b"svn:author", b"");
 
     def setDate(self, date):
-        self.properties.set("svn:date", time.strftime(SVN_DATE_FORMAT, date))
+        # date is a CC_DATE_FORMAT string
+        self.properties.set(b"svn:date", (SVN_DATE_FORMAT % (date[0:4], date[4:6], date[6:8], date[9:11], date[11:13], date[13:15])).encode("ascii"))
 
     def setMessage(self, message):
         try:
-            self.properties.set("svn:log", toUTF8(message));
+            self.properties.set(b"svn:log", toUTF8(message));
         except:
-            self.properties.set("svn:log", "");
+            self.properties.set(b"svn:log", b"");
 
     def setCCRevision(self, ccrevision):
-        self.properties.set("ClearcaseRevision", ccrevision);
+        self.properties.set(b"ClearcaseRevision", toUTF8(ccrevision));
 
     def setCCLabels(self, cclabels):
         labelStr = ", ".join(cclabels)
-        self.properties.set("ClearcaseLabels", labelStr);
+        self.properties.set(b"ClearcaseLabels", toUTF8(labelStr));
+
 
+fileSetSequence = itertools.count(1) # orders the additions to all FileSets
+
+class FileSet:
+    """Paths of the files and dirs in an svn branch or tag.
+
+    A branch copied from another one (svn cp) does not copy the paths of the parent set,
+    it looks them up in the parent and sees only the paths added before the copy.
+    This works because the paths are never removed from a FileSet.
+    For the same reason a path once found in the parents stays there, it is remembered in inherited.
+    """
+    __slots__ = ('root', 'paths', 'parent', 'copySeq', 'inherited')
 
-class FileSet(set):
-    def __init__(self, root):
+    def __init__(self, root, parent=None):
         self.root = root
+        self.paths = {} # path -> sequence number of the addition
+        self.parent = parent
+        self.copySeq = next(fileSetSequence)
+        self.inherited = set() # paths found in the parents, they are not copied to paths
 
     def getAbsolutePath(self, path):
         return self.root + os.sep + path
 
+    def add(self, path):
+        if path not in self.paths:
+            # the same path is stored in each branch and tag, one string is kept for all of them
+            self.paths[sys.intern(path)] = next(fileSetSequence)
+
+    def update(self, paths):
+        for path in paths:
+            self.add(path)
+
+    def __contains__(self, path):
+        if path in self.paths or path in self.inherited:
+            return True
+        fileSet = self
+        limit = self.copySeq
+        while fileSet.parent is not None:
+            fileSet = fileSet.parent
+            added = fileSet.paths.get(path)
+            if added is not None and added < limit:
+                self.inherited.add(path)
+                return True
+            limit = min(limit, fileSet.copySeq)
+        return False
+
+    def __iter__(self):
+        seen = set(self.paths)
+        for path in self.paths:
+            yield path
+        fileSet = self
+        limit = self.copySeq
+        while fileSet.parent is not None:
+            fileSet = fileSet.parent
+            for path, added in fileSet.paths.items():
+                if added < limit and path not in seen:
+                    seen.add(path)
+                    yield path
+            limit = min(limit, fileSet.copySeq)
+
+    def __bool__(self):
+        # the parent was not empty when this set was copied from it
+        return bool(self.paths) or self.parent is not None
+
 class WriteStream:
+    __slots__ = ('enabled', 'file')
+
     def __init__(self, file):
         self.enabled = True
         self.file = file
@@ -584,6 +890,85 @@ class WriteStream:
             self.file.write(data)
 
 
+class BackgroundWriter:
+    """Writes the dump from a separate thread.
+
+    The chunks are passed through a queue so the converter can go on reading the
+    cache and computing checksums while the previous revisions are written.
+    write() waits while more than maxPending bytes are queued, the file contents
+    make the chunks very different in size. Only immutable bytes must be passed to write().
+    """
+    __slots__ = ('file', 'queue', 'error', 'thread', 'pending', 'maxPending', 'space')
+
+    def __init__(self, file, maxPending=DUMPWRITE_MAXPENDING):
+        self.file = file
+        self.queue = queue.Queue()
+        self.error = None
+        self.pending = 0 # bytes queued and not written yet
+        self.maxPending = maxPending
+        self.space = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name="dump writer")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while True:
+            data = self.queue.get()
+            try:
+                if data is None:
+                    break
+                if self.error is None:
+                    self.file.write(data)
+            except Exception as e:
+                self.error = e
+            finally:
+                if data is not None:
+                    with self.space:
+                        self.pending -= len(data)
+                        self.space.notify()
+                self.queue.task_done()
+
+    def checkError(self):
+        if self.error is not None:
+            raise self.error
+
+    def write(self, data):
+        self.checkError()
+        with self.space:
+            while self.pending > 0 and self.pending + len(data) > self.maxPending:
+                self.space.wait()
+            self.pending += len(data)
+        self.queue.put(data)
+
+    def drain(self):
+        # waits until the queued chunks are written or dropped, a write error is kept for checkError()
+        self.queue.join()
+
+    def flush(self):
+        # waits until all the queued chunks are in the file
+        self.drain()
+        self.checkError()
+
+    def stop(self):
+        # the file itself is left open
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    def close(self):
+        self.stop()
+        self.checkError()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if excType is None:
+            self.close()
+        else:
+            self.stop() # a write error must not hide the exception being raised
+
+
 class Converter:
     def __init__(self, dumpfile, labels, branches, ignoredDirectories, autoProps):
         self.autoProps = autoProps
@@ -594,6 +979,9 @@ class Converter:
             self.checklabels = set()
         self.branches = branches
         self.ignoredDirectories = ignoredDirectories
+        if ignoredDirectories is not None:
+            self.ignoredDirectories = tuple(ignoredDirectories) # for str.startswith
+        self.ignoredPrefixes = {} # directory -> True if ignored, or the ignored prefixes longer than the directory
         self.out = WriteStream(dumpfile)
 
         self.svnTree = {} # branch/label -> FileSet
@@ -601,10 +989,11 @@ class Converter:
         self.svnRevNum = 1
         self.cachedir = CACHE_DIR
         self.revProps = SvnRevisionProps()
+        self.cleartool = CleartoolSession(cwd=CC_VOB_DIR)
 
 
     def initializeFile(self):
-        self.out.write("SVN-fs-dump-format-version: 2\n\n")
+        self.out.write(b"SVN-fs-dump-format-version: 2\n\n")
 
         if DUMP_SINCE_DATE is not None:
             self.out.disable()
@@ -615,9 +1004,33 @@ class Converter:
             dumpSvnDir(self.out, getSvnTagPath(""))
 
     def loadState (self, file):
-        stateFile = open (file, "rt")
+        with open (file, "rb") as stateFile:
+            if stateFile.read(len(b"SvnRevNum:")) == b"SvnRevNum:":
+                isTextState = True
+            else:
+                isTextState = False
+                stateFile.seek(0)
+                (svnRevNum, svnTree, ccTree) = pickle.load(stateFile)
+
+        if isTextState:
+            # state file saved by the previous versions of the tool
+            self.loadTextState(file)
+            return
+
+        newSvnTree = {}
+        for key, (root, paths) in svnTree.items():
+            fileSet = FileSet(root)
+            fileSet.update(paths)
+            newSvnTree[key] = fileSet
+
+        self.svnRevNum = svnRevNum
+        self.setCCTree(ccTree)
+        self.svnTree = newSvnTree
+
+    def loadTextState (self, file):
+        stateFile = open (file, "rb")
 
-        lines = stateFiles.readlines()
+        lines = [fromCC(line) for line in stateFile.readlines()]
         state = 0
         newCCTree = set()
         newSvnTree = {}
@@ -645,34 +1058,30 @@ class Converter:
                 continue
         
         stateFile.close();
-        self.ccTree = newCCTree
+        self.setCCTree(newCCTree)
         self.svnTree = newSvnTree
 
 
-    def saveState (self, file):
-        stateFile = open (file, "wt")
-
-        stateFile.write("SvnRevNum:"+self.svnRevNum+"\n");
-        stateFile.write("svnTree:\n");
-        for key, value in self.svnTree.items():
-            stateFile.write (key+"|"+value.root+"\n");
+    def setCCTree(self, versions):
+        self.ccTree = set()
+        for (path, revision) in versions:
+            self.addCCVersion(path, revision)
 
-        stateFile.write("ccTree:\n");
+    def addCCVersion(self, path, revision):
+        # the paths and revisions repeat a lot, keep one copy of each string
+        self.ccTree.add( (sys.intern(path), sys.intern(revision)) )
 
-        for (path, revision) in self.ccTree:
-            stateFile.write(path+"|"+revision+"\n");
-
-        stateFile.close();
+    def saveState (self, file):
+        svnTree = {}
+        for key, value in self.svnTree.items():
+            svnTree[key] = (value.root, list(value))
 
+        with open (file, "wb") as stateFile:
+            pickle.dump((self.svnRevNum, svnTree, list(self.ccTree)), stateFile, protocol=4)
 
-    def setFile(self, file):
-        isDisabled = self.out.disabled()
-        self.out = WriteStream (file)
-        if isDisabled:
-            self.out.disable()
 
     def dumpRevisionHeader(self):
-        self.out.write("Revision-number: " + str(self.svnRevNum) + "\n");
+        self.out.write(b"Revision-number: %d\n" % self.svnRevNum);
         self.svnRevNum += 1
         self.revProps.dump(self.out)
 
@@ -687,14 +1096,20 @@ class Converter:
     def dumpFile(self, ccRecord, action, symlink=False):
         contentFilename = self.getFile(ccRecord.path, ccRecord.revision, symlink)
         props = self.autoProps.getProps(ccRecord.svnpath)
-        if symlink and action is "add":
-            props.set("svn:special", "*")
+        if symlink and action == "add":
+            props.set(b"svn:special", b"*")
         dumpSvnFile(self.out, action, ccRecord.svnpath, props, contentFilename)
 
     def createParentDirs(self, fileSet, path):
-        dir = os.path.dirname(path)
-        if dir and dir not in fileSet:
-            self.createParentDirs(fileSet, dir)
+        # go up to the first known parent, then add the missing dirs starting from the top one
+        missingDirs = []
+        dir = cachedDirname(path)
+        while dir and dir not in fileSet:
+            missingDirs.append(dir)
+            parent = cachedDirname(dir)
+            if parent == dir: break
+            dir = parent
+        for dir in reversed(missingDirs):
             dirpath = fileSet.getAbsolutePath(dir)
             dumpSvnDir(self.out, dirpath)
             fileSet.add(dir)
@@ -708,7 +1123,7 @@ class Converter:
         return fileSet
 
     def processLabels(self, ccRecord, updateLabels=True):
-        self.ccTree.add( (ccRecord.path, ccRecord.revision) )
+        self.addCCVersion(ccRecord.path, ccRecord.revision)
         first = True
         copyfromRev = self.svnRevNum-1
         for cclabel in ccRecord.labels:
@@ -735,10 +1150,20 @@ class Converter:
         if self.ignoredDirectories is None:
             return False
 
-        for directory in self.ignoredDirectories:
-            if path.startswith(directory):
-                info("ignored :" + path);
-                return True
+        # the same directories come for each file, only the prefixes going deeper are checked again
+        directory = cachedDirname(path)
+        prefixes = self.ignoredPrefixes.get(directory)
+        if prefixes is None:
+            dirPrefix = directory and directory + os.sep
+            if dirPrefix.startswith(self.ignoredDirectories):
+                prefixes = True
+            else:
+                prefixes = tuple([prefix for prefix in self.ignoredDirectories if prefix.startswith(dirPrefix)])
+            self.ignoredPrefixes[directory] = prefixes
+
+        if prefixes is True or path.startswith(prefixes):
+            info("ignored :" + path);
+            return True
 
         return False
 
@@ -820,8 +1245,7 @@ class Converter:
                             copyfromPath = getSvnBranchPath(parentSvnBranch)
                             copytoPath = getSvnBranchPath(ccRecord.svnbranch)
 
-                            newBranchFileSet = parentBranchFileSet.copy()
-                            newBranchFileSet.root = copytoPath
+                            newBranchFileSet = FileSet(copytoPath, parent=parentBranchFileSet)
                             self.svnTree[ccRecord.svnbranch] = newBranchFileSet
 
                             dumpSvnCopy(self.out, "dir", copyfromPath, copyfromRev, copytoPath)
@@ -829,7 +1253,7 @@ class Converter:
                         else:
                             error("ClearCase history is corrupted: child branch appeared before the parent one for file " +
                                   ccRecord.path + "@@" + ccRecord.revision)
-                            if IGNORE_CHILD_BRANCH_WARNING == 'true' or askYesNo("Create branch anyway and ignore the error? (or exit)"):
+                            if IGNORE_CHILD_BRANCH_WARNING == 'true' or askYesNo("Create branch anyway and ignore the error? (or exit)", isError=True):
                                 newBranchFileSet = FileSet(getSvnBranchPath(ccRecord.svnbranch))
                                 self.svnTree[ccRecord.svnbranch] = newBranchFileSet
                                 dumpSvnDir(self.out, newBranchFileSet.root)
@@ -872,7 +1296,7 @@ class Converter:
                         branchFileSet.add(ccRecord.path)
                         pass
                     # save the dir version in cc tree for label processing stage
-                    self.ccTree.add( (ccRecord.path, ccRecord.revision) )
+                    self.addCCVersion(ccRecord.path, ccRecord.revision)
                     pass
                 else:
                     # new branch for the dir - wait until there are files in the branch
@@ -910,36 +1334,13 @@ class Converter:
 
         info(path + " " + revision)
 
-        localfile = os.path.normpath(self.cachedir + "/" + path)
-        if revision:
-            localfile = os.path.normpath(localfile + "/" + revision)
+        localfile = cachePathFor(path, revision, self.cachedir)
         localfileDir = os.path.dirname(localfile)
-        if not os.path.exists(localfileDir):
-            os.makedirs(localfileDir, mode=0777)
-
-        cacheExists = os.path.exists(localfile)
-        if cacheExists and CHECK_ZEROSIZE_CACHEFILE:
-            cacheExists = os.path.getsize(localfile) > 0
+        makeDirs(localfileDir)
 
-            if not cacheExists:
-                if os.path.isfile(localfile):
-                    os.chmod (localfile, stat.S_IWRITE)
-                    os.remove (localfile)
-
-                if os.path.isdir(localfile):
-                    os.rmdir (localfile)
-
-        if not cacheExists:
+        if not isCached(localfile):
             if symlink:
-                symlinkfile = os.path.normpath(ccfile)
-                if os.path.islink(symlinkfile):
-                    content = os.readlink(symlinkfile)
-                    outfile = open(localfile, 'wb')
-                    outfile.write("link " + content)
-                    outfile.close()
-                    pass
-                else:
-                    raise RuntimeError("File " + symlinkfile + " is not a symbolic link")
+                cacheSymlink(os.path.normpath(ccfile), localfile)
             else:
                 shutil.copy (ccfile, localfile)
         return localfile
@@ -949,60 +1350,155 @@ class Converter:
 
         info(path + " " + revision)
 
-        localfile = os.path.normpath(self.cachedir + "/" + path)
+        localfile = cachePathFor(path, revision, self.cachedir)
         if revision:
             ccfile = ccfile + "@@" + revision
-            localfile = os.path.normpath(localfile + "/" + revision)
         localfileDir = os.path.dirname(localfile)
-        if not os.path.exists(localfileDir):
-            os.makedirs(localfileDir, mode=0777)
-
-        cacheExists = os.path.exists(localfile)
-        if cacheExists and CHECK_ZEROSIZE_CACHEFILE:
-            cacheExists = os.path.getsize(localfile) > 0
-
-            if not cacheExists:
-                os.chmod (localfile, stat.S_IWRITE)
-                os.remove (localfile)
+        makeDirs(localfileDir)
 
-        if not cacheExists:
+        if not isCached(localfile):
             if symlink:
-                symlinkfile = os.path.normpath(CC_VOB_DIR + os.sep + ccfile)
-                if os.path.islink(symlinkfile):
-                    content = os.readlink(symlinkfile)
-                    outfile = open(localfile, 'wb')
-                    outfile.write("link " + content)
-                    outfile.close()
-                    pass
-                else:
-                    raise RuntimeError("File " + symlinkfile + " is not a symbolic link")
+                cacheSymlink(os.path.normpath(CC_VOB_DIR + os.sep + ccfile), localfile)
             else:
-                cmd = [CLEARTOOL, 'get', '-to', localfile, ccfile]
-                (status, out) = shellCmd(cmd, cwd=CC_VOB_DIR)
+                cmd = ['get', '-to', localfile, ccfile]
+                (status, out) = sessionCmd(self.cleartool, cmd)
                 if status == "ignore":
                     if not os.path.exists(localfile): open(localfile, 'w').close()
         return localfile
 
-    def getFileDetails(self, ccrevfile):
+    def populateCacheAll(self, paths, revision, jobs=FETCH_PARALLELISM):
+        # copies the files from the view to the cache using several threads at once
+        # the records are processed later in the usual serial order
+        if not paths:
+            return
+        pool = ThreadPool(jobs)
+        try:
+            pool.map(lambda path: self.populateCache(path, revision), paths, 16)
+        finally:
+            pool.close()
+            pool.join()
+
+    def prefetch(self, ccRecords, jobs=FETCH_PARALLELISM):
+        # retrieve the file versions missing in the cache using several cleartool processes at once
+        # the records are processed later in the usual serial order
+        work = []
+        queued = set()
+        for ccRecord in ccRecords:
+            if ccRecord.type != "version" or ccRecord.path == ".":
+                continue
+            if ccRecord.operation not in ("checkin", "mkbranch", "mkelem"):
+                continue
+            if (ccRecord.path, ccRecord.revision) in queued:
+                continue
+            svnbranch = len(ccRecord.branchNames) > 0 and ccRecord.branchNames[-1] or "unknown"
+            if self.branches is not None and svnbranch not in self.branches:
+                continue
+            if self.isIgnored(ccRecord.path):
+                continue
+            queued.add((ccRecord.path, ccRecord.revision))
+
+            localfile = cachePathFor(ccRecord.path, ccRecord.revision, self.cachedir)
+            if isCached(localfile):
+                continue
+
+            localfileDir = os.path.dirname(localfile)
+            makeDirs(localfileDir)
+            work.append((localfile, ccRecord.path + "@@" + ccRecord.revision))
+
+        if not work:
+            return
+
+        info("Prefetching " + str(len(work)) + " files from ClearCase using " + str(jobs) + " jobs")
+        pool = ThreadPool(jobs)
+        try:
+            results = pool.map(fetchFile, work, 1)
+        finally:
+            pool.close()
+            pool.join()
+
+        failed = len([status for status in results if status != 0])
+        if failed:
+            warn(str(failed) + " files could not be prefetched, they will be retrieved again during the dump")
+
+    def fileDetailsPath(self, ccrevfile):
+        return os.path.normpath(self.cachedir + "/" + ccrevfile.replace('@@', '/') + "_descr")
 
-        localfile = os.path.normpath(self.cachedir + "/" + ccrevfile.replace('@@', '/') + "_descr")
+    def saveFileDetails(self, localfile, details):
         localfileDir = os.path.dirname(localfile)
-        if not os.path.exists(localfileDir):
-            os.makedirs(localfileDir, mode=0777)
-
-        outStr = ""
-        cacheExists = os.path.exists(localfile) and os.path.getsize(localfile) > 0
-        if cacheExists:
-            with open(localfile, 'r') as file:
-                for line in file:
-                    outStr += line
-        else:
-            cmd = [CLEARTOOL, 'descr', '-fmt', HISTORY_FORMAT, ccrevfile]
-            (status, outStr) = shellCmd(cmd, cwd=CC_VOB_DIR)
-            with open(localfile, 'w') as file:
-                file.write(outStr)
+        makeDirs(localfileDir)
+        # an interrupted run must not leave a partial record in the cache
+        tmpfile = localfile + ".tmp"
+        with open(tmpfile, 'wb') as file:
+            file.write(details)
+        os.replace(tmpfile, localfile)
+
+    def readFileDetails(self, localfile):
+        # the cached descr output, None if it is missing or empty
+        try:
+            with open(localfile, 'rb') as file:
+                return file.read() or None
+        except OSError:
+            return None
+
+    def getFileDetails(self, ccrevfile, localfile=None):
+
+        if localfile is None:
+            localfile = self.fileDetailsPath(ccrevfile)
+
+        outStr = self.readFileDetails(localfile)
+        if outStr is None:
+            cmd = ['descr', '-fmt', HISTORY_FORMAT, ccrevfile]
+            (status, outStr) = sessionCmd(self.cleartool, cmd)
+            if status != "ignore": # a failed command is not cached, the next run asks cleartool again
+                self.saveFileDetails(localfile, outStr)
         return outStr
 
+    def getFileDetailsBulk(self, ccrevfiles):
+        # returns {ccrevfile: details}, the versions missing in the cache are described by batches
+        result = {}
+        batch = []
+        batchChars = 0
+        for ccrevfile in ccrevfiles:
+            if ccrevfile in result:
+                continue
+            localfile = self.fileDetailsPath(ccrevfile)
+            details = self.readFileDetails(localfile)
+            if details is not None:
+                result[ccrevfile] = details
+                continue
+            if batch and (len(batch) >= DESCR_BATCHSIZE or batchChars + len(ccrevfile) > DESCR_BATCHCHARS):
+                self.describeBatch(batch, result)
+                batch = []
+                batchChars = 0
+            result[ccrevfile] = None
+            batch.append((ccrevfile, localfile))
+            batchChars += len(ccrevfile) + 3
+        if batch:
+            self.describeBatch(batch, result)
+        return result
+
+    def describeBatch(self, batch, result):
+        # batch is a list of (ccrevfile, cache file)
+        try:
+            (status, outStr, errStr) = self.cleartool.run(['descr', '-fmt', DESCR_FORMAT] + [version[0] for version in batch])
+            if errStr:
+                # the warnings can not be matched to the versions either
+                status = status or -1
+            records = outStr.split((DESCR_RECORD_SEPARATOR + "\n").encode('ascii'))
+        except KeyboardInterrupt:
+            raise
+        except:
+            error("Command failed: descr of " + str(len(batch)) + " versions\n" + str(sys.exc_info()[1]))
+            status = -1
+        if status != 0 or len(records) != len(batch) + 1 or records[-1].strip():
+            # the records can not be matched to the versions, each version is described alone
+            for (ccrevfile, localfile) in batch:
+                result[ccrevfile] = self.getFileDetails(ccrevfile, localfile)
+            return
+        for ((ccrevfile, localfile), details) in zip(batch, records):
+            self.saveFileDetails(localfile, details)
+            result[ccrevfile] = details
+
     def getLabelContent(self, label):
         labelFilename = os.path.join(CACHE_DIR, label)
         if not os.path.exists(labelFilename):
@@ -1012,18 +1508,20 @@ class Converter:
 
 
     def saveConfigSpec(self, file):
-        cmd = [CLEARTOOL, 'catcs']
-        shellCmd(cmd, cwd=CC_VOB_DIR, outfile=file)
+        (status, outStr) = sessionCmd(self.cleartool, ['catcs'])
+        if status != "ignore": # the session output of a failed command holds the error messages
+            with open(file, 'wb') as specFile:
+                specFile.write(outStr)
 
     def setConfigSpec(self, file):
-        cmd = [CLEARTOOL, 'setcs', file]
-        shellCmd(cmd, cwd=CC_VOB_DIR)
+        # once per label or branch, the session saves a cleartool start-up each time
+        sessionCmd(self.cleartool, ['setcs', file])
 
     def setLabelSpec(self, label):
-        with open(CCVIEW_TMPFILE, 'w') as file:
-            file.write("element * CHECKEDOUT\n")
-            file.write("element * " + label + "\n")
-            file.write("element * /main/0\n")
+        with open(CCVIEW_TMPFILE, 'wb') as file:
+            file.write(b"element * CHECKEDOUT\n")
+            file.write(b"element * " + toCC(label) + b"\n")
+            file.write(b"element * /main/0\n")
         self.setConfigSpec(CCVIEW_TMPFILE)
 
     def completeLabels(self):
@@ -1043,44 +1541,54 @@ class Converter:
             self.setLabelSpec(label)
             try:
                 labelFilename = self.getLabelContent(label)
-                with open(labelFilename, 'r') as file:
-                    for line in file:
-                        ccrevfile = line.strip()
-                        try:
-                            (path, revision) = ccrevfile.split('@@')
-                        except:
-                            warn("label content file " + ccrevfile + " has no revision after @@")
-                            continue
-                        if path == ".": continue
-                        path = os.path.normpath(path)
-
-                        if (path, revision) not in self.ccTree and not self.isIgnored(path):
-                            details = self.getFileDetails(ccrevfile)
-                            ccRecord = parser.processLine(details)
-
-                            if ccRecord and ccRecord.type == "version": # file
-
-                                if DUMP_SINCE_DATE is not None and ccRecord.date > DUMP_SINCE_DATE:
-                                    self.out.enable()
-                                else:
-                                    self.out.disable()
-
-                                info("Found file " + path + "@@" + revision)
-                                self.setRevisionProps(ccRecord)
-                                self.dumpRevisionHeader()
-                                fileSet = self.getTagFileset(label)
-                                self.createParentDirs(fileSet, ccRecord.path)
-
-                                ccRecord.svnpath = fileSet.getAbsolutePath(ccRecord.path)
-                                self.dumpFile(ccRecord, "add")
-                                fileSet.add(ccRecord.path)
-
-                                if label in ccRecord.labels:
-                                    ccRecord.labels.remove(label)
-                                self.processLabels(ccRecord, updateLabels=False)
-                            else:
-                                self.ccTree.add( (path, revision) )
-            except KeyboardInterrupt, e:
+                versions = [] # not converted (ccrevfile, path, revision), described together
+                with open(labelFilename, 'rb') as file:
+                    content = fromCC(file.read())
+                for line in content.split("\n"):
+                    ccrevfile = line.strip()
+                    if not ccrevfile: continue
+                    try:
+                        (path, revision) = ccrevfile.split('@@')
+                    except:
+                        warn("label content file " + ccrevfile + " has no revision after @@")
+                        continue
+                    if path == ".": continue
+                    # each line is a different path, the memoized normpath would only evict the history paths
+                    path = os.path.normpath(path)
+
+                    if (path, revision) not in self.ccTree and not self.isIgnored(path):
+                        versions.append((ccrevfile, path, revision))
+
+                fileDetails = self.getFileDetailsBulk([version[0] for version in versions])
+                ccRecords = [parser.processLine(fileDetails[version[0]]) for version in versions]
+                self.prefetch([ccRecord for ccRecord in ccRecords if ccRecord])
+
+                for ((ccrevfile, path, revision), ccRecord) in zip(versions, ccRecords):
+                    if (path, revision) in self.ccTree: continue
+
+                    if ccRecord and ccRecord.type == "version": # file
+
+                        if DUMP_SINCE_DATE is not None and ccRecord.date > DUMP_SINCE_DATE:
+                            self.out.enable()
+                        else:
+                            self.out.disable()
+
+                        info("Found file " + path + "@@" + revision)
+                        self.setRevisionProps(ccRecord)
+                        self.dumpRevisionHeader()
+                        fileSet = self.getTagFileset(label)
+                        self.createParentDirs(fileSet, ccRecord.path)
+
+                        ccRecord.svnpath = fileSet.getAbsolutePath(ccRecord.path)
+                        self.dumpFile(ccRecord, "add")
+                        fileSet.add(ccRecord.path)
+
+                        if label in ccRecord.labels:
+                            ccRecord.labels.remove(label)
+                        self.processLabels(ccRecord, updateLabels=False)
+                    else:
+                        self.addCCVersion(path, revision)
+            except KeyboardInterrupt as e:
                 raise e
             except:
                 error(str(sys.exc_info()[1]))
@@ -1092,17 +1600,32 @@ class Converter:
 
 ############# main functions ######################
 
-def getCCBranchHistory(branch, filename):
+def readCCHistory(filename):
+    # the file is mapped rather than read, only the text decoded by the parser takes memory
+    # the mapping is released as soon as the caller drops it after parsing
+    with open(filename, 'rb') as historyFile:
+        if os.fstat(historyFile.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(historyFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+def loadCCHistory(cmd, filename):
+    # returns the cleartool output, it is saved to filename to be reused by the next run
     info("Loading CC history to " + filename)
 
     if os.path.exists(filename):
         info("File " + filename + " already exists")
         if askYesNo("Use this file?"):
-            return filename
+            return readCCHistory(filename)
 
+    (status, outStr) = shellCmd(cmd, cwd=CC_VOB_DIR)
+    with open(filename, 'wb') as historyFile:
+        historyFile.write(outStr)
+
+    return outStr
+
+def getCCBranchHistory(branch, filename):
     cmd = [CLEARTOOL, 'lshistory', '-recurse', '-fmt', HISTORY_FORMAT, '-branch', branch]
-    shellCmd(cmd, cwd=CC_VOB_DIR, outfile=filename)
-    pass
+    return loadCCHistory(cmd, filename)
 
 def branchExist(branch):
     cmd = [CLEARTOOL, 'lshistory', '-recurse', '-fmt', HISTORY_FORMAT, '-branch', branch]
@@ -1110,38 +1633,94 @@ def branchExist(branch):
     return (ret == 0)
 
 def getCCHistory(filename):
-    info("Loading CC history to " + filename)
-
-    if os.path.exists(filename):
-        info("File " + filename + " already exists")
-        if askYesNo("Use this file?"):
-            return filename
-
     cmd = [CLEARTOOL, 'lshistory', '-recurse', '-fmt', HISTORY_FORMAT]
-    shellCmd(cmd, cwd=CC_VOB_DIR, outfile=filename)
-    pass
+    return loadCCHistory(cmd, filename)
 
 def readList(filename):
     resList = None
     if filename:
         info("Reading " + filename)
         resList = []
-        with open(filename, 'r') as file:
+        with open(filename, 'rb') as file: # names, decoded like the cleartool output
             for line in file:
-                resList.append(line.strip())
+                resList.append(fromCC(line).strip())
     return resList
 
 def listOfFiles (path):
+    # the same list and order as os.walk gives: the files of a directory, then its subdirectories
+    # the entry types come from the directory listing, there is no stat call for each file
     listFiles = []
+    prefixLen = len(path) + 1
+    stack = [path]
+
+    while stack:
+        subdirs = []
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        # symbolic links to directories are neither listed nor followed
+                        if not entry.is_symlink():
+                            subdirs.append(entry.path)
+                    else:
+                        listFiles.append (entry.path[prefixLen:])
+        except OSError:
+            continue # unreadable directory, skipped by os.walk too
+        stack.extend(reversed(subdirs))
+
+    return listFiles
+
+def processBranch(converter, parser, branch):
+    converter.setConfigSpec (CC_CONFIG_SPEC_DIR + os.sep + branch + ".txt")
+    fileList = listOfFiles (CC_VOB_DIR)
+
+    info("Get ClearCase history for branch " + branch)
+
+    if BRANCH_HISTORY_FILE:
+        with open(BRANCH_HISTORY_FILE, "at") as branchhist:
+            branchhist.write (branch+"\n")
+
+    if branchExist (branch):
+        ccRecords = parser.parseHistory(getCCBranchHistory(branch, HISTORY_FILE))
+
+        # the records are kept in memory, the history is read and parsed once
+        branchFiles = {ccRecord.path for ccRecord in ccRecords}
+
+        if ccRecords: # from the oldest record
+            rev = os.sep.join(ccRecords[0].branchNames + ['0'])
+        else:
+            rev = "/main/"+branch+"/0"
+
+        missingFiles = []
+
+        for filename in fileList:
+            if filename not in branchFiles:
+                missingFiles.append (filename)
+
+        converter.populateCacheAll (missingFiles, rev)
+
+        for filename in missingFiles:
+            ccRecord = parser.mkelemRecord (filename, rev)
+            converter.process (ccRecord)
+
+        converter.prefetch(ccRecords)
+
+        for ccRecord in ccRecords:
+            converter.process(ccRecord)
 
-    for root, dirs, files in os.walk(path):
-        for name in files:
-            fname = os.path.join(root, name)
-            filename = fname[len(path) + 1:]
+        os.remove (HISTORY_FILE)
+    else:
+        missingFiles = []
+        rev = os.sep + "main" + os.sep + branch + os.sep + "0"
 
-            listFiles.append (filename)
+        for filename in fileList:
+            missingFiles.append (filename)
 
-    return listFiles        
+        converter.populateCacheAll (missingFiles, rev)
+
+        for filename in missingFiles:
+            ccRecord = parser.mkelemRecord (filename, rev)
+            converter.process (ccRecord)
 
 def main():
     converter = None
@@ -1152,7 +1731,7 @@ def main():
         branches = readList(CC_BRANCHES_FILE)
         ignoredDirectories = readList(CC_IGNORED_DIRECTORIES_FILE)
         autoProps = SvnAutoProps(SVN_AUTOPROPS_FILE)
-        continuedRun = os.path.exists(RUN_STATE_FILE)
+        continuedRun = RUN_STATE_FILE is not None and os.path.exists(RUN_STATE_FILE)
 
         if not os.path.exists(SVN_DUMP_FILE):
             continuedRun = False
@@ -1167,8 +1746,8 @@ def main():
                 continuedRun = False
 
 
-        with open(SVN_DUMP_FILE, 'ab') as dumpfile:
-            converter = Converter(dumpfile, labels, branches, ignoredDirectories, autoProps)
+        with open(SVN_DUMP_FILE, 'ab', DUMPFILE_BUFSIZE) as dumpfile, BackgroundWriter(dumpfile) as dumpWriter:
+            converter = Converter(dumpWriter, labels, branches, ignoredDirectories, autoProps)
 
             if not continuedRun:
                 converter.initializeFile()
@@ -1178,109 +1757,43 @@ def main():
             if CC_CONFIG_SPEC_DIR:
 
                 for branch in branches:
-                    converter.setConfigSpec (CC_CONFIG_SPEC_DIR + os.sep + branch + ".txt")
-                    fileList = listOfFiles (CC_VOB_DIR)
-
-                    branchSvnDump = open (SVN_TMP_DUMP_FILE, 'wb')
-                    converter.setFile (branchSvnDump)
-
-                    info("Get ClearCase history for branch " + branch)
-
-                    with open(BRANCH_HISTORY_FILE, "at") as branchhist:
-                        branchhist.write (branch+"\n")
-
-                    if branchExist (branch):
-                        getCCBranchHistory(branch, HISTORY_FILE)
-
-                        with open(HISTORY_FILE, 'rb') as historyFile:
-                            lines = rlines(historyFile)
-                            branchFiles = set()
-
-                            rev = ""
-                            first = True
-
-                            for line in lines: # reading lines in reverse order
-                                ccRecord = parser.processLine(line)
-
-                                if ccRecord:
-                                    if first:
-                                        branchPath = ccRecord.branchNames
-                                        branchPath.append ('0')
-                                        rev = os.sep.join(branchPath)
-                                        first = False
-
-                                    branchFiles.add(ccRecord.path)
-
-                            if rev == "":
-                                rev = "/main/"+branch+"/0"
-
-                            missingFiles = []
-
-                            for filename in fileList:
-                                if filename not in branchFiles:
-                                    missingFiles.append (filename)
-
-                            for filename in missingFiles:
-                                ccRecord = parser.mkelemRecord (filename, rev)
-                                converter.populateCache (filename, rev)
-                                converter.process (ccRecord)
-
-                        with open(HISTORY_FILE, 'rb') as historyFile:
-                            lines = rlines(historyFile)
-
-                            for line in lines: # reading lines in reverse order
-                                ccRecord = parser.processLine(line)
-
-                                if ccRecord:
-                                    converter.process(ccRecord)
-
-                        os.remove (HISTORY_FILE)
-                    else:
-                        missingFiles = []
-                        rev = os.sep + "main" + os.sep + branch + os.sep + "0"
-
-                        for filename in fileList:
-                            missingFiles.append (filename)
-
-                        for filename in missingFiles:
-                            ccRecord = parser.mkelemRecord (filename, rev)
-                            converter.populateCache (filename, rev)
-                            converter.process (ccRecord)
-
-                    branchSvnDump.close()
-
-                    branchSvnDump = open (SVN_TMP_DUMP_FILE, "rb")
-                    byte = branchSvnDump.read(1024)
-                    while byte:
-                        dumpfile.write(byte)
-                        byte = branchSvnDump.read(1024)
-
-                    branchSvnDump.close()
-                    converter.setFile (dumpfile)
+                    # the revisions of a failed branch are removed, the dump ends with the last complete branch
+                    dumpWriter.flush()
+                    branchStart = dumpfile.tell()
+                    try:
+                        processBranch(converter, parser, branch)
+                    except BaseException:
+                        # the original exception is raised, not a write error of the dump writer
+                        dumpWriter.drain()
+                        try:
+                            dumpfile.truncate(branchStart)
+                        except OSError as e:
+                            error("Cannot remove the incomplete branch from " + SVN_DUMP_FILE + ": " + str(e))
+                        raise
 
             else:
-                getCCHistory(HISTORY_FILE)
+                historyData = getCCHistory(HISTORY_FILE)
 
                 info("Processing ClearCase history, creating svn dump " + SVN_DUMP_FILE)
 
+                ccRecords = parser.parseHistory(historyData) # from the oldest record
 
-                with open(HISTORY_FILE, 'rb') as historyFile:
-                    for line in rlines(historyFile): # reading lines in reverse order
-                        ccRecord = parser.processLine(line)
+                converter.prefetch(ccRecords)
 
-                        if ccRecord:
-                            converter.process(ccRecord)
+                for ccRecord in ccRecords:
+                    converter.process(ccRecord)
 
             converter.completeLabels()
+            converter.cleartool.close()
 
         info("Completed")
 
     except SystemExit:
         info("Exiting")
-    except KeyboardInterrupt, e:
+    except KeyboardInterrupt as e:
         error("Interrupted by user")
     except:
-        if converter is not None:
+        if converter is not None and RUN_STATE_FILE:
             converter.saveState (RUN_STATE_FILE)
 
 